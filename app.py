@@ -1,83 +1,339 @@
 import streamlit as st
 import ee
 import geemap.foliumap as geemap
+import folium
 import pandas as pd
 import datetime
 import os
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
 
 # --- 1. GEE Initialization ---
+HIGH_VOLUME_URL = 'https://earthengine-highvolume.googleapis.com'
+
+def initialize_ee(project=None):
+    """Initializes GEE, opting into the high-volume endpoint when EE_HIGH_VOLUME=1."""
+    if os.getenv('EE_HIGH_VOLUME') == '1':
+        try:
+            ee.Initialize(project=project, opt_url=HIGH_VOLUME_URL)
+            return
+        except Exception:
+            # Fall back to the standard endpoint below
+            pass
+    ee.Initialize(project=project)
+
 try:
     # Initialize GEE. It will use the default project configured in your local environment
     # or prompt for authentication.
-    ee.Initialize()
+    initialize_ee()
 except Exception as e:
     # If using Cloud Run, we might need a project ID explicitly if not using default credentials
     project_id = os.getenv('EE_PROJECT_ID')
     if project_id:
-        ee.Initialize(project=project_id)
+        initialize_ee(project=project_id)
     else:
         st.error("Google Earth Engine Authentication Failed. Please run `earthengine authenticate` locally or set EE_PROJECT_ID.")
         st.stop()
 
 # --- 2. Helper Functions ---
+# Streamlit reruns the whole script on every widget interaction, so the GEE
+# helpers are cached on hashable inputs (coords tuple, ISO date strings).
+# ee.Image handles are not serializable, hence cache_resource for those.
+
+@st.cache_resource(show_spinner=False)
+def make_roi(coords):
+    """Builds the ROI rectangle from a (min_lon, min_lat, max_lon, max_lat) tuple."""
+    return ee.Geometry.Rectangle(list(coords))
 
-def get_dynamic_world_built_probability(roi, start_date, end_date):
+@st.cache_resource(show_spinner=False)
+def get_dynamic_world_built_probability(coords, start_date, end_date, threshold=0.5):
     """
     Fetches the Dynamic World 'built' class probability.
     Dynamic World Band 6 is 'built'.
     """
+    roi = make_roi(coords)
     dw = ee.ImageCollection('GOOGLE/DYNAMICWORLD/V1') \
         .filterDate(start_date, end_date) \
         .filterBounds(roi)
     
-    # We want the probability of the 'built' class (index 6).
-    # The 'built' probability is often better than the raw label for monitoring growth.
-    # But for simplicity in visualization, let's use the 'label' mode or a probability threshold.
+    # Mean 'built' probability over the period. Cheaper than the mode of the
+    # categorical label and less noisy when comparing periods.
+    probability = dw.select('built').mean().clip(roi)
     
-    # Let's use the Mode of the Class Label for visualization
-    classification = dw.select('label').mode().clip(roi)
-    
-    # Let's create a binary mask: Built (6) = 1, Others = 0
-    built_mask = classification.eq(6).rename('built')
+    # Binary mask: Built = 1, Others = 0
+    built_mask = probability.gt(threshold).rename('built')
     return built_mask
 
+@st.cache_resource(show_spinner=False)
+def get_dynamic_world_built_preview(coords, start_date, end_date, threshold=0.5):
+    """
+    Fast Dynamic World built-up mask for the map layers only.
+    Each pixel comes from the latest clear scene (mosaic) instead of a mean
+    over the whole period, so a tile reads one image rather than all of them.
+    Area statistics use get_dynamic_world_built_probability.
+    """
+    roi = make_roi(coords)
+    dw = ee.ImageCollection('GOOGLE/DYNAMICWORLD/V1') \
+        .filterDate(start_date, end_date) \
+        .filterBounds(roi)
+    
+    # mosaic() rather than first(): a single DW scene rarely covers the whole ROI.
+    # mosaic() puts the last image on top, so sort oldest first.
+    return dw.sort('system:time_start').select('built').mosaic().gt(threshold).clip(roi).rename('built')
+
+# Only the true-colour bands are displayed, so nothing else is loaded
+S2_BANDS = ['B4', 'B3', 'B2']
+
+# Cloud Score+ per-pixel clear-sky score, linked onto each S2 scene
+CLOUD_SCORE_PLUS = 'GOOGLE/CLOUD_SCORE_PLUS/V1/S2_HARMONIZED'
+CLEAR_THRESHOLD = 0.6
+
 def mask_s2_clouds(image):
-  qa = image.select('QA60')
-  cloud_bit_mask = 1 << 10
-  cirrus_bit_mask = 1 << 11
-  mask = qa.bitwiseAnd(cloud_bit_mask).eq(0).And(qa.bitwiseAnd(cirrus_bit_mask).eq(0))
-  return image.updateMask(mask).divide(10000)
-
-def get_s2_image(roi, start_date, end_date):
-    """Fetches a Sentinel-2 cloud-free median composite."""
+  # Keep pixels with a Cloud Score+ cs_cdf (1 = clear) at or above the
+  # threshold that are not SCL snow/ice, then scale to reflectance.
+  clear = image.select('cs_cdf').gte(CLEAR_THRESHOLD)
+  not_snow = image.select('SCL').neq(11)
+  return image.select(S2_BANDS).updateMask(clear.And(not_snow)).divide(10000)
+
+@st.cache_resource(show_spinner=False)
+def get_s2_image(coords, start_date, end_date, use_mosaic=True):
+    """
+    Fetches a Sentinel-2 cloud-free composite.
+    The map only needs RGB, so by default a mosaic (least cloudy scene on top)
+    is used instead of the much slower per-pixel median.
+    """
+    roi = make_roi(coords)
     s2 = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
         .filterDate(start_date, end_date) \
         .filterBounds(roi) \
-        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)) \
-        .map(mask_s2_clouds)
+        .linkCollection(ee.ImageCollection(CLOUD_SCORE_PLUS), ['cs_cdf'])
     
-    return s2.median().clip(roi)
+    if use_mosaic:
+        # mosaic() puts the last image on top, so sort cloudiest first.
+        # Sort before masking: image math drops the scene properties.
+        return s2.sort('CLOUDY_PIXEL_PERCENTAGE', False).map(mask_s2_clouds).mosaic().clip(roi)
+    return s2.map(mask_s2_clouds).median().clip(roi)
 
-def calculate_built_area(built_image, roi):
-    """Calculates the area of built-up pixels in km²."""
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_tile_url(image_json, vis_params):
+    """
+    Returns the XYZ tile URL for a serialized ee.Image.
+    Keyed on the serialized graph, so unchanged layers skip the getMapId
+    request on later reruns.
+    """
+    image = ee.Image(ee.deserializer.fromJSON(image_json))
+    return image.getMapId(vis_params)['tile_fetcher'].url_format
+
+def ee_tile_layer(image, vis_params, name):
+    """Builds a folium tile layer for an ee.Image from its cached tile URL."""
+    return folium.TileLayer(
+        tiles=get_tile_url(image.serialize(), vis_params),
+        attr='Google Earth Engine',
+        name=name,
+        overlay=True,
+        control=True
+    )
+
+def submit_in_background(fn, *args):
+    """
+    Runs fn(*args) on its own worker thread and returns the future.
+    One thread per request, so a session never queues behind other users';
+    the thread exits once fn returns.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(fn, *args)
+    executor.shutdown(wait=False)
+    return future
+
+@st.cache_data(show_spinner=False)
+def get_roi_area_km2(coords):
+    """Returns the ROI area in km² (fetched once per ROI)."""
+    return make_roi(coords).area(maxError=100).divide(1e6).getInfo()
+
+def select_area_scale(area_km2, precise=False):
+    """
+    Picks the reduceRegion scale (m) from the ROI size, keeping the pixel
+    count, and so the request time, bounded for large regions.
+    Precise mode steps down one level but never below 10 m.
+    """
+    scales = [10, 30, 100]
+    if area_km2 < 100:
+        level = 0
+    elif area_km2 < 2000:
+        level = 1
+    else:
+        level = 2
+    if precise:
+        level = max(level - 1, 0)
+    return scales[level]
+
+def built_area_stats(coords, start_date_1, end_date_1, start_date_2, end_date_2, scale=30, threshold=0.5):
+    """
+    Builds the (unevaluated) built-up area sums in m² for both periods,
+    as an ee.Dictionary with keys 'area_1' and 'area_2'.
+    The scale comes from select_area_scale. At 30 m the totals stay close to
+    Dynamic World's native 10 m. At 100 m the mean probability is thresholded
+    per 1 ha cell, so sparse or scattered built-up pixels are dropped and the
+    area is noticeably underestimated. Use it for trends, not absolute km².
+    """
+    roi = make_roi(coords)
+    built1 = get_dynamic_world_built_probability(coords, start_date_1, end_date_1, threshold)
+    built2 = get_dynamic_world_built_probability(coords, start_date_2, end_date_2, threshold)
     pixel_area = ee.Image.pixelArea()
-    built_area_img = pixel_area.updateMask(built_image.eq(1))
     
-    stats = built_area_img.reduceRegion(
+    # One band per period, so a single reduceRegion returns both sums
+    built_area_img = pixel_area.updateMask(built1.eq(1)).rename('area_1') \
+        .addBands(pixel_area.updateMask(built2.eq(1)).rename('area_2'))
+    
+    return built_area_img.reduceRegion(
         reducer=ee.Reducer.sum(),
         geometry=roi,
-        scale=10,
+        scale=scale,
         maxPixels=1e10,
         tileScale=4
     )
+
+def to_km2(stats):
+    """Converts the evaluated area sums (m², None when empty) to a km² pair."""
+    area1 = (stats.get('area_1') or 0.0) / 1e6
+    area2 = (stats.get('area_2') or 0.0) / 1e6
+    return area1, area2
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def calculate_built_areas(coords, start_date_1, end_date_1, start_date_2, end_date_2, scale=30, threshold=0.5):
+    """Calculates the built-up area in km² for both periods in one round-trip."""
+    stats = built_area_stats(coords, start_date_1, end_date_1, start_date_2, end_date_2, scale, threshold)
+    return to_km2(stats.getInfo())
+
+@st.cache_resource(show_spinner=False)
+def get_export_registry():
+    """
+    Cross-session store of built-area exports, keyed by the same arguments as
+    calculate_built_areas: running tasks ('pending') and km² pairs ('done').
+    Sessions with the same inputs share one export instead of starting more.
+    The lock only guards the dicts; no network call is made while holding it.
+    """
+    return {'pending': {}, 'done': {}, 'lock': threading.Lock()}
+
+def get_finished_export(registry, stats_args):
+    """
+    Returns the cached km² pair for stats_args, or None. Entries older than
+    EXPORT_RESULT_TTL are evicted, matching calculate_built_areas' ttl.
+    Call with registry['lock'] held.
+    """
+    now = time.monotonic()
+    expired = [k for k, (finished, _) in registry['done'].items() if now - finished > EXPORT_RESULT_TTL]
+    for k in expired:
+        del registry['done'][k]
+    entry = registry['done'].get(stats_args)
+    return entry[1] if entry else None
+
+def start_built_area_export(stats_args):
+    """
+    Starts a batch export of the built-up area sums for requests too large
+    for an interactive reduceRegion, unless one for the same arguments is
+    already running or finished.
+    """
+    registry = get_export_registry()
+    with registry['lock']:
+        if get_finished_export(registry, stats_args) is not None or stats_args in registry['pending']:
+            return
+        # Reserve the slot so other sessions don't start a second task meanwhile
+        registry['pending'][stats_args] = None
+    
+    try:
+        stats = built_area_stats(*stats_args)
+        asset_id = f'{EXPORT_ASSET_ROOT}/built_area_{uuid.uuid4().hex}'
+        task = ee.batch.Export.table.toAsset(
+            collection=ee.FeatureCollection([ee.Feature(None, stats)]),
+            description='karabakh_built_area',
+            assetId=asset_id
+        )
+        task.start()
+    except Exception:
+        with registry['lock']:
+            registry['pending'].pop(stats_args, None)
+        raise
+    
+    with registry['lock']:
+        registry['pending'][stats_args] = {'task_id': task.id, 'asset_id': asset_id, 'collecting': False}
+
+def check_built_area_export(stats_args):
+    """
+    Checks the built-area export for stats_args once, without blocking.
+    Returns (state, areas): areas is the km² pair once the export has been
+    collected, otherwise None with the task state ('FAILED' if it is gone).
+    """
+    registry = get_export_registry()
+    with registry['lock']:
+        areas = get_finished_export(registry, stats_args)
+        if areas is not None:
+            return 'COMPLETED', areas
+        if stats_args not in registry['pending']:
+            # Dropped after failing in another session
+            return 'FAILED', None
+        task = registry['pending'][stats_args]
+    if task is None:
+        # Another session is still starting it
+        return 'READY', None
+    
+    state = ee.data.getTaskStatus(task['task_id'])[0]['state']
+    if state in ('READY', 'RUNNING'):
+        return state, None
+    if state != 'COMPLETED':
+        # Any other state (FAILED, CANCELLED, UNKNOWN, ...) is final
+        with registry['lock']:
+            registry['pending'].pop(stats_args, None)
+        return state, None
+    
+    with registry['lock']:
+        # Only one session reads and deletes the asset
+        areas = get_finished_export(registry, stats_args)
+        if areas is not None:
+            return 'COMPLETED', areas
+        if task['collecting']:
+            return 'RUNNING', None
+        task['collecting'] = True
+    
+    try:
+        stats = ee.FeatureCollection(task['asset_id']).first().toDictionary().getInfo()
+    except Exception:
+        logger.exception("Could not read built-area export %s", task['asset_id'])
+        with registry['lock']:
+            registry['pending'].pop(stats_args, None)
+        return 'FAILED', None
+    
+    try:
+        # The asset only carries this result; don't leave it behind
+        ee.data.deleteAsset(task['asset_id'])
+    except Exception:
+        logger.warning("Could not delete built-area export %s", task['asset_id'], exc_info=True)
     
-    area_sq_m = stats.get('area').getInfo()
-    if area_sq_m:
-        return area_sq_m / 1e6
-    return 0.0
+    areas = to_km2(stats)
+    with registry['lock']:
+        registry['done'][stats_args] = (time.monotonic(), areas)
+        registry['pending'].pop(stats_args, None)
+    return 'COMPLETED', areas
 
 # --- 3. Streamlit App Layout ---
 
+# First Sentinel-2 surface reflectance scenes; earlier dates return nothing
+S2_SR_START = datetime.date(2017, 3, 28)
+# Longer periods only add images to every reduction without adding detail
+MAX_PERIOD_DAYS = 366
+# Above this many pixels (ROI area / scale²) the area reduction runs as a batch
+# export instead of an interactive request, which can time out. Needs
+# EE_PROJECT_ID for the asset.
+EXPORT_PIXELS = 1e7
+# Finished export results are reused across sessions for this long (seconds)
+EXPORT_RESULT_TTL = 3600
+EXPORT_ASSET_ROOT = f"projects/{os.getenv('EE_PROJECT_ID')}/assets" if os.getenv('EE_PROJECT_ID') else None
+
 st.set_page_config(layout="wide", page_title="Karabakh Reconstruction Monitor")
 
 st.title("🛰️ Karabakh Post-Conflict Reconstruction Monitor")
@@ -97,112 +353,243 @@ with st.sidebar:
         "Shusha": [46.72, 39.73, 46.78, 39.78],
         "Custom (Draw on Map)": None
     }
-    location_name = st.selectbox("Select Region", list(location_options.keys()))
-    
-    # Date Selectors
-    st.subheader("Time Comparison")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown("**Before**")
-        start_date_1 = st.date_input("Start", datetime.date(2020, 6, 1))
-        end_date_1 = st.date_input("End", datetime.date(2020, 9, 30))
-    with col2:
-        st.markdown("**After**")
-        start_date_2 = st.date_input("Start", datetime.date(2024, 6, 1))
-        end_date_2 = st.date_input("End", datetime.date(2024, 9, 30))
+    
+    # Settings live in a form so the app only reruns on submit,
+    # not on every widget interaction
+    with st.form("analysis_form"):
+        location_name = st.selectbox("Select Region", list(location_options.keys()))
+        
+        # Date Selectors (bounded to the Sentinel-2 SR archive)
+        st.subheader("Time Comparison")
+        date_bounds = {'min_value': S2_SR_START, 'max_value': datetime.date.today()}
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**Before**")
+            start_date_1 = st.date_input("Start", datetime.date(2020, 6, 1), **date_bounds)
+            end_date_1 = st.date_input("End", datetime.date(2020, 9, 30), **date_bounds)
+        with col2:
+            st.markdown("**After**")
+            start_date_2 = st.date_input("Start", datetime.date(2024, 6, 1), **date_bounds)
+            end_date_2 = st.date_input("End", datetime.date(2024, 9, 30), **date_bounds)
+        
+        built_threshold = st.slider("Built-up probability threshold", 0.1, 0.9, 0.5, 0.05)
+        precise = st.checkbox(
+            "Precise area (finer scale, slower)",
+            value=False,
+            help="Has no effect for regions under 100 km² (the city presets), which are already reduced at 10 m."
+        )
+        
+        submitted = st.form_submit_button("Analyze Change")
 
     st.info("Tip: Choose Summer months for best cloud-free images.")
 
 # Main Content
 row1_col1, row1_col2 = st.columns([3, 1])
 
+# Period Validation
+for period_start, period_end in ((start_date_1, end_date_1), (start_date_2, end_date_2)):
+    if period_end <= period_start:
+        st.error("Each period's end date must be after its start date.")
+        st.stop()
+    if (period_end - period_start).days > MAX_PERIOD_DAYS:
+        st.error(f"Each period can span at most {MAX_PERIOD_DAYS} days.")
+        st.stop()
+
 # ROI Handling
 if location_name == "Custom (Draw on Map)":
     st.warning("⚠️ Please use the drawing tool on the map to define your custom ROI.")
-    roi = None
 else:
-    coords = location_options[location_name]
-    roi = ee.Geometry.Rectangle(coords)
+    coords = tuple(location_options[location_name])
 
-# Map Initialization
-m = geemap.Map()
+@st.fragment
+def render_split_map(zoom, year_1, year_2, edge_inset_m=0):
+    """
+    Renders the before/after split map from the results in session state.
+    Runs as a fragment, so toggling the checkbox only re-renders the map
+    instead of rerunning the whole analysis.
+    edge_inset_m trims the built-up overlays away from the ROI border, so edge
+    tiles of large regions need no change computation.
+    """
+    results = st.session_state.get('results')
+    if results is None:
+        return
+    img1, img2 = results['img1'], results['img2']
+    built1, built2 = results['built1'], results['built2']
+    roi = make_roi(results['roi_coords'])
+    
+    if edge_inset_m:
+        # Coarse maxError keeps the negative buffer itself cheap
+        overlay_region = roi.buffer(-edge_inset_m, 100)
+        built1, built2 = built1.clip(overlay_region), built2.clip(overlay_region)
+    
+    m = geemap.Map()
+    m.centerObject(roi, zoom)
+    
+    vis_params = {'min': 0.0, 'max': 0.3, 'bands': ['B4', 'B3', 'B2']}
+    
+    # Controls
+    show_change = st.checkbox("Hightlight New Construction (Red)", value=True)
+
+    if show_change:
+        # Logic:
+        # New Construction = Built in 2024 AND NOT Built in 2020
+        # Pre-existing = Built in 2020 AND Built in 2024
+        
+        # 1. Create Masks
+        new_construction = built2.And(built1.Not()).rename('new_construction')
+        projected_old = built1 # Just show what was there in 2020
+        
+        # 2. Visualize
+        # Pre-existing in 2020 (Yellow/Gray - subtle)
+        old_vis = projected_old.updateMask(projected_old).visualize(palette=['yellow'], opacity=0.4)
+        
+        # New Construction (Bright Red)
+        new_vis = new_construction.updateMask(new_construction).visualize(palette=['red'], opacity=0.8)
+        
+        # 3. Create Composites for Split Map
+        
+        # LEFT (2020): Satellite + Existing Buildings (Yellow)
+        s1_vis = img1.visualize(**vis_params)
+        left_image = ee.ImageCollection([s1_vis, old_vis]).mosaic()
+        
+        # RIGHT (2024): Satellite + Existing (Yellow) + NEW (Red)
+        s2_vis = img2.visualize(**vis_params)
+        # We add old_vis to right side too so you see context, and new_vis on top
+        right_image = ee.ImageCollection([s2_vis, old_vis, new_vis]).mosaic()
+        
+        left_layer = ee_tile_layer(left_image, {}, f'{year_1} (Yellow=Existing)')
+        right_layer = ee_tile_layer(right_image, {}, f'{year_2} (Red=New)')
+    else:
+        left_layer = ee_tile_layer(img1, vis_params, f'Satellite {year_1}')
+        right_layer = ee_tile_layer(img2, vis_params, f'Satellite {year_2}')
+    
+    m.split_map(left_layer, right_layer)
+    m.to_streamlit(height=600)
+
+@st.fragment(run_every=2)
+def render_export_progress():
+    """
+    Polls the session's pending export every 2 s as a fragment, so the rest of
+    the app stays interactive while it runs. Reruns the app once the areas are in.
+    """
+    results = st.session_state.get('results')
+    if results is None:
+        return
+    if 'export_error' in results:
+        st.error(f"Built-up area export {results['export_error'].lower()}, please submit again.")
+        return
+    if 'export' not in results:
+        return
+    
+    state, areas = check_built_area_export(results['export'])
+    if areas is not None:
+        results['area1'], results['area2'] = areas
+        del results['export']
+        st.rerun()
+    elif state in ('READY', 'RUNNING'):
+        st.text(f"Large region: built-up area export {state.lower()}...")
+    else:
+        # Keep the results (the map fragment reads them), forget the export;
+        # the error stays until the next submit starts a fresh one
+        del results['export']
+        results['export_error'] = state
+        st.error(f"Built-up area export {state.lower()}, please submit again.")
 
 # Session State for Analysis
 if 'analyzed' not in st.session_state:
     st.session_state['analyzed'] = False
 
 # Trigger Analysis
-if st.button("Analyze Change"):
+if submitted:
     st.session_state['analyzed'] = True
 
 # Calculate & Display (Persist if analyzed)
 if st.session_state['analyzed']:
     if location_name == "Custom (Draw on Map)":
         st.error("Custom drawing is experimental. Please select a preset region for now.")
-        roi = ee.Geometry.Rectangle(location_options["Agdam/Fuzuli (Wide)"])
-        m.centerObject(roi, 10)
+        coords = tuple(location_options["Agdam/Fuzuli (Wide)"])
+        zoom = 10
     else:
-        m.centerObject(roi, 11)
-
-    with st.spinner("Fetching Satellite Data & AI Analysis..."):
-        # 1. Get Images (Visuals)
-        # Cache results if possible, but GEE lazy eval handles this reasonably well
-        img1 = get_s2_image(roi, str(start_date_1), str(end_date_1))
-        img2 = get_s2_image(roi, str(start_date_2), str(end_date_2))
-        
-        # 2. Get AI Analysis (Built-up)
-        built1 = get_dynamic_world_built_probability(roi, str(start_date_1), str(end_date_1))
-        built2 = get_dynamic_world_built_probability(roi, str(start_date_2), str(end_date_2))
-        
-        # 3. Calculate Stats
-        area1 = calculate_built_area(built1, roi)
-        area2 = calculate_built_area(built2, roi)
-        growth = area2 - area1
-        
-        # 4. Display Stats
-        st.metric(label=f"Built Area ({start_date_1.year})", value=f"{area1:.2f} km²")
-        st.metric(label=f"Built Area ({start_date_2.year})", value=f"{area2:.2f} km²", delta=f"{growth:.2f} km²")
-        
-        # 5. Split Map
-        vis_params = {'min': 0.0, 'max': 0.3, 'bands': ['B4', 'B3', 'B2']}
-        
-        # Controls
-        show_change = st.checkbox("Hightlight New Construction (Red)", value=True)
+        zoom = 11
+    
+    # Only the wide preset is large enough for its edge tiles to matter
+    edge_inset_m = 500 if coords == tuple(location_options["Agdam/Fuzuli (Wide)"]) else 0
 
-        if show_change:
-            # Logic:
-            # New Construction = Built in 2024 AND NOT Built in 2020
-            # Pre-existing = Built in 2020 AND Built in 2024
-            
-            # 1. Create Masks
-            new_construction = built2.And(built1.Not()).rename('new_construction')
-            projected_old = built1 # Just show what was there in 2020
+    # Reruns with unchanged inputs reuse the stored handles and areas
+    # instead of rebuilding the GEE graphs
+    area_km2 = get_roi_area_km2(coords)
+    area_scale = select_area_scale(area_km2, precise)
+    if precise and area_scale == select_area_scale(area_km2):
+        st.caption("Precise area has no effect here: this region is already reduced at 10 m.")
+    key = (location_name, str(start_date_1), str(end_date_1), str(start_date_2), str(end_date_2), built_threshold, area_scale)
+    results = st.session_state.get('results')
+    if results is None or results['key'] != key:
+        with st.spinner("Fetching Satellite Data & AI Analysis..."):
+            # 1. Get Images (Visuals)
+            img1 = get_s2_image(coords, str(start_date_1), str(end_date_1))
+            img2 = get_s2_image(coords, str(start_date_2), str(end_date_2))
             
-            # 2. Visualize
-            # Pre-existing in 2020 (Yellow/Gray - subtle)
-            old_vis = projected_old.updateMask(projected_old).visualize(palette=['yellow'], opacity=0.4)
+            # 2. Get AI Analysis (Built-up) for the map overlays
+            built1 = get_dynamic_world_built_preview(coords, str(start_date_1), str(end_date_1), built_threshold)
+            built2 = get_dynamic_world_built_preview(coords, str(start_date_2), str(end_date_2), built_threshold)
             
-            # New Construction (Bright Red)
-            new_vis = new_construction.updateMask(new_construction).visualize(palette=['red'], opacity=0.8)
-            
-            # 3. Create Composites for Split Map
-            
-            # LEFT (2020): Satellite + Existing Buildings (Yellow)
-            s1_vis = img1.visualize(**vis_params)
-            left_image = ee.ImageCollection([s1_vis, old_vis]).mosaic()
-            
-            # RIGHT (2024): Satellite + Existing (Yellow) + NEW (Red)
-            s2_vis = img2.visualize(**vis_params)
-            # We add old_vis to right side too so you see context, and new_vis on top
-            right_image = ee.ImageCollection([s2_vis, old_vis, new_vis]).mosaic()
-            
-            left_layer = geemap.ee_tile_layer(left_image, {}, f'2020 (Yellow=Existing)')
-            right_layer = geemap.ee_tile_layer(right_image, {}, f'2024 (Red=New)')
+            results = {
+                'key': key,
+                'roi_coords': coords,
+                'img1': img1,
+                'img2': img2,
+                'built1': built1,
+                'built2': built2,
+            }
+            st.session_state['results'] = results
+    
+    # 3. Calculate Stats (both periods in a single request)
+    # The pending export / future is kept with the results so an interrupted
+    # run can still pick it up; a failed one is dropped so the next submit retries.
+    if submitted:
+        results.pop('export_error', None)
+    if not any(k in results for k in ('area1', 'area_future', 'export', 'export_error')):
+        stats_args = (
+            coords, str(start_date_1), str(end_date_1), str(start_date_2), str(end_date_2),
+            area_scale, built_threshold
+        )
+        pixel_count = area_km2 * 1e6 / area_scale ** 2
+        if pixel_count > EXPORT_PIXELS and EXPORT_ASSET_ROOT:
+            # Too large for an interactive request: export and poll below
+            start_built_area_export(stats_args)
+            results['export'] = stats_args
         else:
-            left_layer = geemap.ee_tile_layer(img1, vis_params, f'Satellite {start_date_1.year}')
-            right_layer = geemap.ee_tile_layer(img2, vis_params, f'Satellite {start_date_2.year}')
+            # Started in the background so the blocking reduceRegion
+            # overlaps with the map's tile requests below
+            results['area_future'] = submit_in_background(calculate_built_areas, *stats_args)
+    
+    # 4. Display Stats (filled in once the areas arrive)
+    stats_container = st.container()
+    
+    # 5. Split Map
+    render_split_map(zoom, start_date_1.year, start_date_2.year, edge_inset_m)
+    
+    with stats_container:
+        if 'area1' not in results:
+            if 'export' in results or 'export_error' in results:
+                # Polled in the background; the app reruns once the areas are in
+                render_export_progress()
+                st.stop()
+            else:
+                with st.spinner("Calculating built-up area..."):
+                    try:
+                        results['area1'], results['area2'] = results['area_future'].result()
+                    except Exception as e:
+                        # Forget only the failed future: the map fragment still
+                        # reads the results, and the next submit recomputes
+                        results.pop('area_future', None)
+                        st.error(f"Built-up area calculation failed, please try again: {e}")
+                        st.stop()
         
-        m.split_map(left_layer, right_layer)
-
-# Display Map
-m.to_streamlit(height=600)
+        area1, area2 = results['area1'], results['area2']
+        growth = area2 - area1
+        st.metric(label=f"Built Area ({start_date_1.year})", value=f"{area1:.2f} km²")
+        st.metric(label=f"Built Area ({start_date_2.year})", value=f"{area2:.2f} km²", delta=f"{growth:.2f} km²")
+else:
+    # Display Map
+    geemap.Map().to_streamlit(height=600)
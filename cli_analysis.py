@@ -1,76 +1,169 @@
 import ee
 import geemap
-import pandas as pd
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Headless: render straight to PNG, no GUI backend lookup
 import matplotlib.pyplot as plt
 import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 # 1. Initialize Google Earth Engine
-# 1. Initialize Google Earth Engine
-try:
+HIGH_VOLUME_URL = 'https://earthengine-highvolume.googleapis.com'
+
+def initialize_ee():
+    """Initializes GEE, opting into the high-volume endpoint when EE_HIGH_VOLUME=1."""
+    if os.getenv('EE_HIGH_VOLUME') == '1':
+        try:
+            ee.Initialize(opt_url=HIGH_VOLUME_URL)
+            print("Using the high-volume Earth Engine endpoint.")
+            return
+        except Exception:
+            print("High-volume endpoint unavailable, falling back to the standard endpoint.")
     ee.Initialize()
+
+try:
+    initialize_ee()
     print("Google Earth Engine initialized successfully.")
 except Exception as e:
     print("Authentication required. Please authenticate in the browser window that opens.")
     ee.Authenticate()
-    ee.Initialize()
+    initialize_ee()
 
 # 2. Define Region of Interest (ROI)
 # Agdam/Fuzuli area: [46.50, 39.30, 47.50, 40.50] (min_lon, min_lat, max_lon, max_lat)
-roi = ee.Geometry.Rectangle([46.50, 39.30, 47.50, 40.50])
+ROI_COORDS = (46.50, 39.30, 47.50, 40.50)
+roi = ee.Geometry.Rectangle(list(ROI_COORDS))
 
 print("ROI defined.")
 
 # --- Helper Functions ---
 
+# Spectral bands used for classification
+bands = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+
+# Cloud Score+ scores; pixels below CLEAR_THRESHOLD count as cloudy
+CLOUD_SCORE_PLUS = 'GOOGLE/CLOUD_SCORE_PLUS/V1/S2_HARMONIZED'
+CLEAR_THRESHOLD = 0.6
+
 def mask_s2_clouds(image):
-    """Masks clouds in Sentinel-2 images."""
-    qa = image.select('QA60')
-    cloud_bit_mask = 1 << 10
-    cirrus_bit_mask = 1 << 11
-    mask = qa.bitwiseAnd(cloud_bit_mask).eq(0).And(qa.bitwiseAnd(cirrus_bit_mask).eq(0))
-    return image.updateMask(mask).divide(10000)
-
-def get_summer_composite(year, roi):
-    """Generates a cloud-free summer median composite for a given year."""
+    """
+    Masks clouds and snow in Sentinel-2 images.
+    Pixels are kept where the linked Cloud Score+ cs_cdf (1 = clear) reaches
+    CLEAR_THRESHOLD and SCL is not snow/ice.
+    """
+    clear = image.select('cs_cdf').gte(CLEAR_THRESHOLD)
+    not_snow = image.select('SCL').neq(11)
+    return image.select(bands).updateMask(clear.And(not_snow)).divide(10000)
+
+@functools.lru_cache(maxsize=16)
+def get_summer_composite(year, roi_coords, use_mosaic=False):
+    """
+    Generates a cloud-free summer composite for a given year.
+    Memoized on the hashable coords tuple: an ee.Image is only a client-side
+    graph reference, so repeated calls can share one.
+    25th percentile by default: it suppresses residual cloud/haze better than
+    the median and gives the classifier stable radiometry.
+    use_mosaic=True gives a faster composite suitable for display only.
+    """
     start_date = f'{year}-06-01'
     end_date = f'{year}-09-30'
+    roi = ee.Geometry.Rectangle(list(roi_coords))
     
     collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
                   .filterDate(start_date, end_date)
                   .filterBounds(roi)
-                  .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))
-                  .map(mask_s2_clouds))
+                  .linkCollection(ee.ImageCollection(CLOUD_SCORE_PLUS), ['cs_cdf']))
+    
+    if use_mosaic:
+        # mosaic() puts the last image on top, so sort cloudiest first.
+        # Sort before masking: image math drops the scene properties.
+        return collection.sort('CLOUDY_PIXEL_PERCENTAGE', False).map(mask_s2_clouds).mosaic().clip(roi)
     
-    composite = collection.median().clip(roi)
+    # percentile() suffixes band names with '_p25'; restore them for select(bands)
+    composite = collection.map(mask_s2_clouds).reduce(ee.Reducer.percentile([25])).rename(bands).clip(roi)
     return composite
 
 # 3. AUTOMATED TRAINING DATA GENERATION
-print("Preparing training data...")
+# The training points never change between runs, so they are exported once to
+# an asset and reused. Set EE_TRAINING_ASSET (or EE_PROJECT_ID) to enable this;
+# bump the version suffix when the sampling or compositing changes. The ROI is
+# part of the asset ID, so changing ROI_COORDS never loads another ROI's points.
+project_id = os.getenv('EE_PROJECT_ID')
+TRAINING_ASSET_BASE = os.getenv('EE_TRAINING_ASSET') or (
+    f'projects/{project_id}/assets/karabakh_training_v1' if project_id else None
+)
+# e.g. '46p50_39p30_47p50_40p50' ('.' is not allowed in asset IDs)
+ROI_TAG = '_'.join(f'{c:.2f}'.replace('.', 'p').replace('-', 'm') for c in ROI_COORDS)
+TRAINING_ASSET_ID = f'{TRAINING_ASSET_BASE}_{ROI_TAG}' if TRAINING_ASSET_BASE else None
 
-# Load Sentinel-2 2020 composite for training
-s2_2020 = get_summer_composite(2020, roi)
+def asset_exists(asset_id):
+    """Checks whether an Earth Engine asset exists."""
+    try:
+        return ee.data.getInfo(asset_id) is not None
+    except ee.EEException:
+        return False
 
-# Load ESA WorldCover 2020
-worldcover = ee.Image('ESA/WorldCover/v100/2020').clip(roi)
+def export_in_progress(asset_id, description):
+    """Checks for a queued or running export task writing to asset_id."""
+    for task in ee.data.getTaskList():
+        if task.get('state') not in ('UNSUBMITTED', 'READY', 'RUNNING'):
+            continue
+        destinations = task.get('destination_uris', [])
+        if any(asset_id in uri for uri in destinations):
+            return True
+        # Older task listings carry no destination; fall back to the description
+        if not destinations and task.get('description') == description:
+            return True
+    return False
 
-# Remap WorldCover: Class 50 (Built-up) -> 1, Others -> 0
-# WorldCover classes: 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 100
-# We remap 50 to 1, and everything else to 0. Use remap for simplicity on known classes or expression.
-# To be robust, let's create a binary image.
-built_up = worldcover.eq(50)
+def sample_training_points(roi_coords):
+    """Samples built-up / non-built-up training points against ESA WorldCover 2020."""
+    roi = ee.Geometry.Rectangle(list(roi_coords))
+    
+    # Load Sentinel-2 2020 composite for training
+    s2_2020 = get_summer_composite(2020, roi_coords)
+    
+    # Load ESA WorldCover 2020
+    worldcover = ee.Image('ESA/WorldCover/v100/2020').clip(roi)
+    
+    # Remap WorldCover: Class 50 (Built-up) -> 1, Others -> 0
+    # WorldCover classes: 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 100
+    # We remap 50 to 1, and everything else to 0. Use remap for simplicity on known classes or expression.
+    # To be robust, let's create a binary image.
+    built_up = worldcover.eq(50)
+    
+    # Create training points
+    # Use stratified sample to get points for class 0 (non-built-up) and class 1 (built-up)
+    training_image = s2_2020.addBands(built_up.rename('class'))
+    
+    return training_image.select(bands + ['class']).stratifiedSample(
+        numPoints=1000,
+        classBand='class',
+        region=roi,
+        scale=30,  # Increased scale for training sampling speed
+        geometries=True
+    )
 
-# Create training points
-# Use stratified sample to get points for class 0 (non-built-up) and class 1 (built-up)
-training_image = s2_2020.addBands(built_up.rename('class'))
-bands = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+print("Preparing training data...")
 
-points = training_image.select(bands + ['class']).stratifiedSample(
-    numPoints=1000,
-    classBand='class',
-    region=roi,
-    scale=30,  # Increased scale for training sampling speed
-    geometries=True
-)
+if TRAINING_ASSET_ID and asset_exists(TRAINING_ASSET_ID):
+    print(f"Loading cached training points from {TRAINING_ASSET_ID}...")
+    points = ee.FeatureCollection(TRAINING_ASSET_ID)
+else:
+    points = sample_training_points(ROI_COORDS)
+    if TRAINING_ASSET_ID and export_in_progress(TRAINING_ASSET_ID, 'karabakh_training'):
+        # A previous run's export has not finished yet; don't start a second one
+        print(f"Training points export to {TRAINING_ASSET_ID} is still running; sampling for this run only.")
+    elif TRAINING_ASSET_ID:
+        # Runs in the background; this run keeps using the freshly sampled points
+        task = ee.batch.Export.table.toAsset(
+            collection=points,
+            description='karabakh_training',
+            assetId=TRAINING_ASSET_ID
+        )
+        task.start()
+        print(f"Exporting training points to {TRAINING_ASSET_ID} for later runs (task {task.id}).")
 
 # Train Random Forest
 print("Training Random Forest Classifier...")
@@ -82,37 +175,68 @@ classifier = ee.Classifier.smileRandomForest(50).train(
 
 # 4. TIME-SERIES ANALYSIS
 years = [2020, 2021, 2022, 2023, 2024]
-results = []
+years_arr = np.array(years)
+areas_arr = np.empty(len(years))
 urban_growth_data = {}
 
 print("Starting Time-Series Analysis...")
 
-for year in years:
-    print(f"Processing year {year}...")
-    
-    # Get image
-    image = get_summer_composite(year, roi)
-    
-    # Classify
-    classified = image.select(bands).classify(classifier)
-    
-    # Calculate Area
-    # Create an image where each pixel is the area in square meters
-    pixel_area = ee.Image.pixelArea()
-    
-    # Mask non-urban pixels (value 0)
-    urban_area_img = pixel_area.updateMask(classified.eq(1))
-    
-    # Sum area over ROI
-    stats = urban_area_img.reduceRegion(
+# Stack every year's composite into one image (6 bands x 5 years),
+# band names suffixed with the year, e.g. 'B2_2020'
+yearly = ee.Image.cat([
+    get_summer_composite(year, ROI_COORDS).select(bands).rename([f'{b}_{year}' for b in bands])
+    for year in years
+])
+
+def classify_year(year):
+    """Classifies one year's view of the stacked image (1 = urban)."""
+    return yearly.select([f'{b}_{year}' for b in bands]).rename(bands).classify(classifier)
+
+classified_by_year = {year: classify_year(year) for year in years}
+
+# Keep 2024 classification for visualization
+classified_2024 = classified_by_year[2024]
+
+# One urban band per year, multiplied by the per-pixel area in square meters
+urban_masks = ee.Image.cat([classified_by_year[year].eq(1).rename(f'area_{year}') for year in years])
+urban_area_img = urban_masks.multiply(ee.Image.pixelArea())
+
+# Sum area over ROI for all years in a single reduceRegion / getInfo() round-trip.
+# It runs on a worker thread so the map's getMapId requests below overlap with it.
+with ThreadPoolExecutor(max_workers=1) as executor:
+    stats_future = executor.submit(urban_area_img.reduceRegion(
         reducer=ee.Reducer.sum(),
         geometry=roi,
         scale=30,       # Optimization: 30m scale to reduce pixel count
         maxPixels=1e10, # Increased maxPixels limit
         tileScale=4     # Optimization: tileScale to split computation
-    )
-    
-    area_sq_m = stats.get('area').getInfo()
+    ).getInfo)
+
+    # 5. VISUALIZATION
+
+    # Interactive Map
+    print("Generating Map...")
+    m = geemap.Map()
+    m.centerObject(roi, 10)
+
+    # Add Satellite Imagery (2024), reusing the composite from the time series
+    s2_2024 = get_summer_composite(2024, ROI_COORDS)
+    vis_params = {'min': 0.0, 'max': 0.3, 'bands': ['B4', 'B3', 'B2']}
+    m.addLayer(s2_2024, vis_params, 'Sentinel-2 2024')
+
+    # Add Urban Detection Layer (Red)
+    urban_vis = {'min': 1, 'max': 1, 'palette': ['red']}
+    # We mask 0 values to be transparent, so only value 1 is shown
+    m.addLayer(classified_2024.updateMask(classified_2024.eq(1)), urban_vis, 'Urban Growth 2024')
+
+    m.save('map.html')
+    print("Map saved to map.html")
+
+    # Wait for the area reduction
+    stats = stats_future.result()
+
+for i, year in enumerate(years):
+    area_sq_m = stats.get(f'area_{year}')
     
     if area_sq_m is None:
          area_sq_km = 0
@@ -121,45 +245,19 @@ for year in years:
     
     print(f"Year {year}: {area_sq_km:.2f} km²")
     
-    results.append({'Year': year, 'Urban Area (km²)': area_sq_km})
+    areas_arr[i] = area_sq_km
     urban_growth_data[year] = area_sq_km
-    
-    # Keep 2024 classification for visualization
-    if year == 2024:
-        classified_2024 = classified
-
-# 5. VISUALIZATION
-
-# DataFrame
-df = pd.DataFrame(results)
 
 # Line Chart
-plt.figure(figsize=(10, 6))
-plt.plot(df['Year'], df['Urban Area (km²)'], marker='o', linestyle='-', color='b')
-plt.title('Urban Growth in Agdam/Fuzuli (2020-2024)')
-plt.xlabel('Year')
-plt.ylabel('Built-Up Area (km²)')
-plt.grid(True)
-plt.xticks(years)
-plt.savefig('growth_chart.png')
+fig, ax = plt.subplots(figsize=(10, 6))
+ax.plot(years_arr, areas_arr, marker='o', linestyle='-', color='b')
+ax.set_title('Urban Growth in Agdam/Fuzuli (2020-2024)')
+ax.set_xlabel('Year')
+ax.set_ylabel('Built-Up Area (km²)')
+ax.grid(True)
+ax.set_xticks(years_arr)
+fig.savefig('growth_chart.png', dpi=100)
+plt.close(fig)
 print("Chart saved to growth_chart.png")
 
-# Interactive Map
-print("Generating Map...")
-m = geemap.Map()
-m.centerObject(roi, 10)
-
-# Add Satellite Imagery (2024)
-s2_2024 = get_summer_composite(2024, roi)
-vis_params = {'min': 0.0, 'max': 0.3, 'bands': ['B4', 'B3', 'B2']}
-m.addLayer(s2_2024, vis_params, 'Sentinel-2 2024')
-
-# Add Urban Detection Layer (Red)
-urban_vis = {'min': 1, 'max': 1, 'palette': ['red']}
-# We mask 0 values to be transparent, so only value 1 is shown
-m.addLayer(classified_2024.updateMask(classified_2024.eq(1)), urban_vis, 'Urban Growth 2024')
-
-m.save('map.html')
-print("Map saved to map.html")
-
 print("Processing complete.")